@@ -0,0 +1,104 @@
+"""
+DT-Box-Inference
+Pavel Chigirev, pavelchigirev.com, 2023-2024
+See LICENSE.txt for details
+"""
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import argparse
+import queue
+import subprocess
+import sys
+import time
+
+# python DTBenchmark.py model.keras --runs 3
+# python DTBenchmark.py --check-normalization (needs scikit-learn)
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+def measure_import(module_name):
+    # Fresh interpreter for every run so nothing is cached in sys.modules
+    code = f"import time; t = time.perf_counter(); import {module_name}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=script_dir, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def measure_first_prediction(model_path, warm_up):
+    from ModelContainer import ModelContainer, SessionContainer
+    import numpy as np
+
+    start_time = time.perf_counter()
+    container = ModelContainer(0, model_path, os.path.basename(model_path), queue.Queue(), queue.Queue(), lambda: False)
+    container.load_models()
+    if warm_up:
+        container.warm_up()
+    ready_time = time.perf_counter()
+
+    session = SessionContainer(0, container, container.dataset_len, None, None)
+    req_data = np.random.standard_normal(container.dataset_len)
+    container.predict_all(session.normalize_standard(req_data))
+    first_time = time.perf_counter()
+
+    container.predict_all(session.normalize_standard(req_data))
+    second_time = time.perf_counter()
+
+    return ready_time - start_time, first_time - ready_time, second_time - first_time
+
+def check_normalization():
+    # Compares numpy normalization with the StandardScaler it replaced, including flat and
+    # near-flat windows at price-like magnitudes where the zero variance check matters
+    from ModelContainer import SessionContainer
+    from sklearn.preprocessing import StandardScaler
+    import numpy as np
+
+    window_size = 60
+    rng = np.random.default_rng(0)
+    windows = {
+        "flat 38123.45": np.full(window_size, 38123.45),
+        "flat 1.23456": np.full(window_size, 1.23456),
+        "flat 0.0": np.zeros(window_size),
+        "near-flat 38123.45 + 1e-9 ramp": 38123.45 + np.arange(window_size) * 1e-9,
+        "near-flat 38123.45 + 1e-6 noise": 38123.45 + rng.standard_normal(window_size) * 1e-6,
+        "random walk 1.1": 1.1 + np.cumsum(rng.standard_normal(window_size) * 1e-4),
+        "random walk 38123.45": 38123.45 + np.cumsum(rng.standard_normal(window_size)),
+    }
+
+    session = SessionContainer(0, None, window_size, None, None)
+    is_ok = True
+    for name, window in windows.items():
+        expected = StandardScaler().fit_transform(window.reshape(-1, 1)).flatten()
+        normalized = session.normalize_standard(window).flatten()
+
+        series = np.concatenate([window, window[::-1]])
+        expected_windows = np.array([StandardScaler().fit_transform(w.reshape(-1, 1)).flatten() for w in np.lib.stride_tricks.sliding_window_view(series, window_size)])
+        sliding_windows = session.create_sliding_windows(series, window_size)
+
+        max_diff = max(np.abs(normalized - expected).max(), np.abs(sliding_windows - expected_windows).max())
+        is_window_ok = max_diff <= 1e-6
+        is_ok = is_ok and is_window_ok
+        print(f"{'ok  ' if is_window_ok else 'FAIL'} {name}: max difference {max_diff:.3e}")
+
+    return is_ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import-time and time-to-first-prediction benchmark")
+    parser.add_argument("model", nargs="?", help="Keras model file used for the first prediction benchmark")
+    parser.add_argument("--runs", type=int, default=3, help="Number of import measurements per module")
+    parser.add_argument("--check-normalization", action="store_true", help="Compare normalization with sklearn StandardScaler and exit")
+    args = parser.parse_args()
+
+    if args.check_normalization:
+        sys.exit(0 if check_normalization() else 1)
+
+    for module_name in ["ModelContainer", "keras.api.models"]:
+        times = [measure_import(module_name) for _ in range(args.runs)]
+        print(f"import {module_name}: min {min(times):.3f} s, max {max(times):.3f} s")
+
+    if args.model:
+        for warm_up in [False, True]:
+            # Keras keeps state per process, so each mode gets its own interpreter
+            code = f"import DTBenchmark; print(*DTBenchmark.measure_first_prediction({args.model!r}, {warm_up}))"
+            result = subprocess.run([sys.executable, "-c", code], cwd=script_dir, capture_output=True, text=True, check=True)
+            load_time, first_time, second_time = map(float, result.stdout.strip().splitlines()[-1].split())
+            print(f"warm-up {'on ' if warm_up else 'off'}: load {load_time:.3f} s, first prediction {first_time * 1000:.3f} ms, second prediction {second_time * 1000:.3f} ms")
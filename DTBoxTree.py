@@ -63,9 +63,10 @@ class DTBoxTree:
         self.detele_row2_btn = ttk.Button(self.frame_buttons, text=" - ", command=self.delete_row, width=3)
         self.exp_coll2_button = ttk.Button(self.frame_buttons, text="S/H", command=self.toggle, width=4)
 
-        self.add_row2_btn.pack(side="left", padx=(self.indent, 0))
-        self.detele_row2_btn.pack(side="left", padx=(5, 0))
-        self.exp_coll2_button.pack(side="left", padx=(5, 0))
+        # Row controls stick to the right edge, so adding buttons doesn't need a new indent
+        self.exp_coll2_button.pack(side="right", padx=(5, 0))
+        self.detele_row2_btn.pack(side="right", padx=(5, 0))
+        self.add_row2_btn.pack(side="right", padx=(self.indent, 0))
 
     def __init__(self, root, label_text, indent): 
         self.root = root
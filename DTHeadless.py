@@ -0,0 +1,117 @@
+"""
+DT-Box-Inference
+Pavel Chigirev, pavelchigirev.com, 2023-2024
+See LICENSE.txt for details
+"""
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import argparse
+import logging
+import queue
+import sys
+from ModelContainer import *
+
+# python DTHeadless.py model1.keras model2.keras --port 16505 --ensemble model3.keras model4.keras [--shm]
+# While running, type "profile <port>" to start/stop profiling of a model container
+
+class DTBoxHeadless:
+    def __init__(self, model_paths, ensembles, start_port, log_latencies, transport = transport_socket):
+        self.containers = {}
+        self.start_port = start_port
+        self.log_latencies = log_latencies
+        self.transport = transport
+
+        self.q_state = queue.Queue()
+        self.q_log_messages = queue.Queue()
+
+        logging.basicConfig(format='%(asctime)s.%(msecs)03d: %(message)s', datefmt='%Y-%m-%d %H:%M:%S', level=logging.INFO)
+        self.dtlogger = logging.getLogger()
+        self.q_log_messages.put("Welcome to DT-Box-Inference (headless)")
+
+        self.th_preload = threading.Thread(target=preload_backend, args=(self.q_log_messages,))
+        self.th_preload.daemon = True
+        self.th_preload.start()
+
+        for model_path in model_paths:
+            self.add_model(model_path)
+
+        for ensemble_paths in ensembles:
+            self.add_ensemble(ensemble_paths)
+
+    def allow_log_latencies(self):
+        return self.log_latencies
+
+    def add_container(self, container):
+        self.containers[str(self.start_port)] = container
+        self.start_port += 1
+
+        th_cc = threading.Thread(target=container.start_container, args=())
+        th_cc.start()
+
+    def add_model(self, model_path):
+        file_with_extension = os.path.basename(model_path)
+        container = ModelContainer(self.start_port, model_path, file_with_extension, self.q_state, self.q_log_messages, self.allow_log_latencies, self.transport)
+        self.add_container(container)
+
+    def add_ensemble(self, model_paths):
+        ensemble_name = "+".join([os.path.splitext(os.path.basename(model_path))[0] for model_path in model_paths])
+        container = EnsembleContainer(self.start_port, model_paths, ensemble_name, self.q_state, self.q_log_messages, self.allow_log_latencies, self.transport)
+        self.add_container(container)
+
+    def process_messages(self):
+        while not self.q_state.empty():
+            state_vals = self.q_state.get().split(',', 1)
+            if state_vals[0] in self.containers:
+                self.dtlogger.info(f"{self.containers[state_vals[0]].model_full_name} [{state_vals[0]}]: {state_vals[1]}")
+
+        while not self.q_log_messages.empty():
+            self.dtlogger.info(self.q_log_messages.get())
+
+    def process_commands(self):
+        for line in sys.stdin:
+            cmd = line.split()
+            if len(cmd) == 2 and cmd[0] == "profile":
+                if cmd[1] in self.containers:
+                    self.containers[cmd[1]].toggle_profiling()
+                else:
+                    self.q_log_messages.put(f"Cannot find container on {cmd[1]} port")
+            elif len(cmd) > 0:
+                self.q_log_messages.put(f"Unknown command: {line.strip()}")
+
+    def run(self):
+        th_commands = threading.Thread(target=self.process_commands, args=())
+        th_commands.daemon = True
+        th_commands.start()
+
+        try:
+            while True:
+                self.process_messages()
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            self.on_closing()
+
+    def on_closing(self):
+        stop_ths = []
+        for key in self.containers:
+            th = threading.Thread(target=self.containers[key].on_closing, args=())
+            th.start()
+            stop_ths.append(th)
+
+        for th in stop_ths:
+            th.join()
+
+        self.process_messages()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run DT-Box-Inference without the UI")
+    parser.add_argument("models", nargs="*", help="Keras model files, one port per model")
+    parser.add_argument("--ensemble", nargs="+", action="append", default=[], help="Keras model files served together on one port")
+    parser.add_argument("--port", type=int, default=16505, help="First port to use")
+    parser.add_argument("--log-latencies", action="store_true", help="Log single prediction time")
+    parser.add_argument("--shm", action="store_true", help="Serve clients through shared memory ring buffers instead of sockets")
+    args = parser.parse_args()
+
+    transport = transport_shared_memory if args.shm else transport_socket
+    DTBoxHeadless(args.models, args.ensemble, args.port, args.log_latencies, transport).run()
@@ -17,7 +17,7 @@ from DTBoxTree import *
 from DTBoxLogger import *
 from ModelContainer import *
 
-# pyinstaller --clean --noconsole --onedir --hiddenimport numpy --hiddenimport tensorflow --hiddenimport keras --hiddenimport scikit-learn --icon "Logo2.ico" --add-data "Logo2.ico;." --name "DT-Box-Inference" DTInference.py
+# pyinstaller --clean --noconsole --onedir --hiddenimport numpy --hiddenimport tensorflow --hiddenimport keras --icon "Logo2.ico" --add-data "Logo2.ico;." --name "DT-Box-Inference" DTInference.py
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 icon_path = os.path.join(script_dir, 'Logo2.ico')
@@ -54,7 +54,10 @@ class DTBoxInference:
         self.always_on_top.set(True)
         self.root.wm_attributes("-topmost", 1)
 
-        self.dtbox_tree = DTBoxTree(self.root, "Models:", 189)
+        self.use_shared_memory = tk.BooleanVar()
+        self.use_shared_memory.set(False)
+
+        self.dtbox_tree = DTBoxTree(self.root, "Models:", 10)
         
         dtbox_tree_config = DTBoxTreeConfig()
         dtbox_tree_config.add_column("Model Name", 200)
@@ -63,7 +66,9 @@ class DTBoxInference:
         self.dtbox_tree.create_tree(dtbox_tree_config)
 
         dtbox_tree_config.add_button("Add Model", lambda:self.on_add_model_button(), 14, 10)
+        dtbox_tree_config.add_button("Add Ensemble", lambda:self.on_add_ensemble_button(), 14, 10)
         dtbox_tree_config.add_button("Remove Model", lambda:self.on_del_model_button(), 14, 10)
+        dtbox_tree_config.add_button("Profile", lambda:self.on_profile_model_button(), 8, 10)
         self.dtbox_tree.create_buttons(dtbox_tree_config)
 
         self.logger = DTBoxLogger(self.root, "Inference Log:", 188)
@@ -73,12 +78,14 @@ class DTBoxInference:
         self.frame_footer = ttk.Frame(self.root)
         self.checkbutton = tk.Checkbutton(self.frame_footer, text="Always on Top", variable=self.always_on_top, command=self.set_always_on_top)
         self.checkbutton.pack(side='left')
+        self.shm_checkbutton = tk.Checkbutton(self.frame_footer, text="Shared memory for new models", variable=self.use_shared_memory)
+        self.shm_checkbutton.pack(side='left', padx=(10, 0))
         self.link = tk.Label(self.frame_footer, text="https://pavelchigirev.com/", fg="blue", cursor="hand2")
-        self.link.pack(side='left', padx=(300, 0))
+        self.link.pack(side='left', padx=(110, 0))
         self.link.bind("<Button-1>", self.link_callback)
 
         # Grid layout
-        self.dtbox_tree.frame_buttons.grid(row=0, column=0, sticky='w', padx=10, pady=(10, 7))
+        self.dtbox_tree.frame_buttons.grid(row=0, column=0, sticky='we', padx=10, pady=(10, 7))
         self.dtbox_tree.frame_tree.grid(row=1, column=0, sticky='w', padx=10, pady=(0, 7))
         self.logger.frame_buttons.grid(row=2, column=0, sticky='w', padx=10, pady=(0, 7))
         self.logger.frame_log.grid(row=3, column=0, sticky='w', padx=10, pady=(0, 7))
@@ -96,6 +103,11 @@ class DTBoxInference:
         self.dtlogger.setLevel(logging.INFO)
         self.q_log_messages.put("Welcome to DT-Box-Inference")
 
+        # Import the inference backend while the window is already up
+        self.th_preload = threading.Thread(target=preload_backend, args=(self.q_log_messages,))
+        self.th_preload.daemon = True
+        self.th_preload.start()
+
         self.root.after(100, self.process_states)
         self.root.after(200, self.process_log_messages)
         self.root.mainloop()
@@ -109,6 +121,9 @@ class DTBoxInference:
     def allow_log_latencies(self):
         return self.logger.show_latencies.get()
 
+    def get_transport(self):
+        return transport_shared_memory if self.use_shared_memory.get() else transport_socket
+
     def process_states(self):
         # Model states
         while not self.q_state.empty():
@@ -135,7 +150,7 @@ class DTBoxInference:
             file_with_extension = os.path.basename(filename)
             file_without_extension = os.path.splitext(file_with_extension)[0]
 
-            container = ModelContainer(self.start_port, filename, file_with_extension, self.q_state, self.q_log_messages, self.allow_log_latencies)
+            container = ModelContainer(self.start_port, filename, file_with_extension, self.q_state, self.q_log_messages, self.allow_log_latencies, self.get_transport())
             self.containers[str(self.start_port)] = container
             self.start_port += 1
 
@@ -144,6 +159,25 @@ class DTBoxInference:
             self.th_cc = threading.Thread(target=container.start_container, args=())
             self.th_cc.start()
 
+    def on_add_ensemble_button(self):
+        filenames = filedialog.askopenfilenames(filetypes=(("Keras model files", "*.keras"),))
+        if len(filenames) < 2:
+            if len(filenames) == 1:
+                messagebox.showinfo("Add Ensemble", "Select at least two models to create an ensemble")
+            return
+
+        files_without_extension = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+        ensemble_name = "+".join(files_without_extension)
+
+        container = EnsembleContainer(self.start_port, list(filenames), ensemble_name, self.q_state, self.q_log_messages, self.allow_log_latencies, self.get_transport())
+        self.containers[str(self.start_port)] = container
+        self.start_port += 1
+
+        self.dtbox_tree.tree.insert('', 'end', values=[ensemble_name, container.port, 'Added'])
+
+        self.th_cc = threading.Thread(target=container.start_container, args=())
+        self.th_cc.start()
+
     def on_start_model_button(self):
         selection = self.dtbox_tree.tree.selection()
         if (len(selection) == 0):
@@ -157,6 +191,18 @@ class DTBoxInference:
     def on_stop_model_button(self):
         pass
 
+    def on_profile_model_button(self):
+        selection = self.dtbox_tree.tree.selection()
+        if (len(selection) == 0):
+            return
+
+        item = selection[0]
+        item_values = self.dtbox_tree.tree.item(item, 'values')
+        if item_values[1] not in self.containers.keys(): raise Exception("Cannot find container")
+
+        self.th_cc = threading.Thread(target=self.containers[item_values[1]].toggle_profiling, args=())
+        self.th_cc.start()
+
     def on_del_model_button(self):
         selection = self.dtbox_tree.tree.selection()
         if (len(selection) == 0):
@@ -5,14 +5,15 @@ See LICENSE.txt for details
 """
 
 import numpy as np
-from keras.api.models import load_model
 import socket
 import threading
 import queue
 import struct
 from collections import deque
 import time
-from sklearn.preprocessing import StandardScaler
+from concurrent.futures import ThreadPoolExecutor
+from SharedMemoryServer import SharedMemoryServer
+from ModelProfiler import ModelProfiler, create_thread_marker
 
 cmd_new_connection = "cmd_nc"
 cmd_init_data = "cmd_id"
@@ -20,6 +21,34 @@ cmd_next_data_point = "cmd_ndp"
 cmd_close_connection = "cmd_cc"
 cmd_heartbeat = "cmd_hb"
 
+transport_socket = "Socket"
+transport_shared_memory = "Shared memory"
+
+# Keras (and TensorFlow behind it) takes seconds to import, so it is loaded on first use
+# or in the background by preload_backend() while the UI comes up
+def load_model(model_path):
+    from keras.api.models import load_model as keras_load_model
+    return keras_load_model(model_path)
+
+def preload_backend(q_log_messages = None):
+    start_time = time.time()
+    import keras.api.models
+    if q_log_messages != None:
+        q_log_messages.put(f'Inference backend loaded in {time.time() - start_time:.3f} seconds')
+
+# Matches sklearn StandardScaler.fit_transform on a single column. Constant windows get scale 1,
+# constancy is checked relative to the magnitude of the data as in sklearn _is_constant_feature,
+# a flat window of prices has rounding noise variance far above machine epsilon
+def standardize(np_array, axis = None):
+    mean = np_array.mean(axis=axis, keepdims=True)
+    var = np_array.var(axis=axis, keepdims=True)
+    n = np_array.size if axis == None else np_array.shape[axis]
+    eps = np.finfo(np.float64).eps
+    is_constant = var <= n * eps * var + (n * np.abs(mean) * eps) ** 2
+    std = np.sqrt(var)
+    std[is_constant | (std < 10 * eps)] = 1.0
+    return (np_array - mean) / std
+
 class SessionContainer:
     def __init__(self, session_id, model_container, dataset_len, client_socket, client_address):
         self.session_id = session_id
@@ -34,22 +63,14 @@ class SessionContainer:
         self.dataset_len = dataset_len
         self.data_queue = deque(maxlen = self.dataset_len)
 
-        self.scaler = StandardScaler()
-
     def normalize_standard(self, np_array):
-        np_array_reshaped = np_array.reshape(-1, 1)
-        normalized_array = self.scaler.fit_transform(np_array_reshaped).flatten()
-        return normalized_array.reshape(1, -1)
+        return standardize(np_array.astype(float)).reshape(1, -1)
 
     def create_sliding_windows(self, data, window_size):
-        num_windows = len(data) - window_size + 1
-        windows = []
-        for i in range(num_windows):
-            window = data[i:i+window_size]
-            window_normalized = self.scaler.fit_transform(window.reshape(-1, 1)).flatten()
-            windows.append(window_normalized)
-    
-        return np.array(windows)
+        if len(data) < window_size:
+            return np.empty((0, window_size))
+        windows = np.lib.stride_tricks.sliding_window_view(data, window_size)
+        return standardize(windows, axis=1)
 
     def send_data(self, msg):
         msg_size = struct.pack('<q', len(msg))
@@ -82,10 +103,10 @@ class SessionContainer:
                 return
             
             data.extend(buffer)
-            self.decode_data(data)
+            self.model_container.profiler.run(self.decode_data, data)
 
             if len(data) == 0:
-                self.run_model()
+                self.model_container.profiler.run(self.run_model)
         
     def run_model(self):
         while not self.q_recv.empty():
@@ -117,12 +138,18 @@ class SessionContainer:
                     self.data_queue.append(req_data)
 
                 req_data_n = self.create_sliding_windows(req_data, self.dataset_len)
-                prediction = self.model_container.predict(req_data_n)
+                predictions = self.model_container.predict_all(req_data_n)
+                if predictions == None:
+                    self.close_remove_session()
+                    return
 
-                flattened_array = prediction.flatten()
+                # One comma-separated series per model, models separated by ';'
                 zeros_list = [0.0] * (self.dataset_len - 1) 
-                response_list = zeros_list + flattened_array.tolist()
-                response_str = ",".join(map(lambda x: "{:.5f}".format(x), response_list))
+                response_strs = []
+                for prediction in predictions:
+                    response_list = zeros_list + prediction.flatten().tolist()
+                    response_strs.append(",".join(map(lambda x: "{:.5f}".format(x), response_list)))
+                response_str = ";".join(response_strs)
 
                 self.send_data(response_str)
 
@@ -137,13 +164,16 @@ class SessionContainer:
             if request_cmd == cmd_next_data_point:
                 self.data_queue.append(float(request))
                 if len(self.data_queue) < self.dataset_len:
-                    self.send_data('0.0')
+                    self.send_data(";".join(['0.0'] * self.model_container.num_models))
                     return
 
                 req_data = np.array(self.data_queue)
                 req_data_n = self.normalize_standard(req_data)
-                prediction = self.model_container.predict(req_data_n)
-                self.send_data("{:.5f}".format(prediction[0][0]))
+                predictions = self.model_container.predict_all(req_data_n)
+                if predictions == None:
+                    self.close_remove_session()
+                    return
+                self.send_data(";".join(map(lambda x: "{:.5f}".format(x[0][0]), predictions)))
                 end_time = time.time()
                 if self.model_container.allow_log_latencies():
                     self.model_container.q_log_messages.put(f'{self.model_container.port}:{self.session_id} Single prediciton {end_time - start_time:.6f} seconds')
@@ -160,14 +190,16 @@ class SessionContainer:
         self.client_socket.close()
 
 class ModelContainer:
-    def __init__(self, port, model_path, model_full_name, q_state, q_log_messages, allow_log_latencies):
+    def __init__(self, port, model_path, model_full_name, q_state, q_log_messages, allow_log_latencies, transport = transport_socket):
         self.is_active = True
+        self.transport = transport
 
         self.server_socket = None
         self.host = '127.0.0.1'
         self.port = port
         self.model_path = model_path
         self.model_full_name = model_full_name
+        self.num_models = 1
 
         self.lock = threading.Lock()
         self.q_state = q_state
@@ -178,25 +210,48 @@ class ModelContainer:
         self.sessions = {}
         self.add_remove_session_lock = threading.Lock()
 
-        self.q_log_messages.put(f'Model container for {model_full_name} model has been created on {port} port')
+        traced_functions = [SessionContainer.run_model, SessionContainer.create_sliding_windows, SessionContainer.decode_data]
+        self.profiler = ModelProfiler(port, q_log_messages, traced_functions)
+
+        self.q_log_messages.put(f'Model container for {model_full_name} model has been created on {port} port ({transport})')
         
     def predict(self, input_data):
         with self.lock:
             return self.model.predict(input_data, verbose=0)
 
+    # Returns None once the container has been stopped
+    def predict_all(self, input_data):
+        return [self.predict(input_data)]
+
+    def load_models(self):
+        self.model = load_model(self.model_path)
+        self.dataset_len:int = self.model.input_shape[1]
+        return True
+
+    def warm_up(self):
+        # First predict builds the inference graph, pay it here rather than on a live tick
+        start_time = time.time()
+        self.predict_all(np.zeros((1, self.dataset_len)))
+        self.q_log_messages.put(f"{self.port} Model warmed up in {time.time() - start_time:.3f} seconds")
+
     def run_server(self):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen()
+        if self.transport == transport_shared_memory:
+            # Same accept/close interface as a listening socket, channels behave like client sockets
+            self.server_socket = SharedMemoryServer(self.port)
+        else:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen()
         self.q_state.put(f"{self.port},Model loaded. Waiting connection...")
-        self.q_log_messages.put(f"{self.port} Socket server started. Waiting connection...")
+        self.q_log_messages.put(f"{self.port} {self.transport} server started. Waiting connection...")
 
         try:
             while self.is_active:
                 client_socket, client_address = self.server_socket.accept()
                 with self.add_remove_session_lock:
                     self.sessions[self.session_id] = SessionContainer(self.session_id, self, self.dataset_len, client_socket, client_address)
-                client_thread = threading.Thread(target=self.sessions[self.session_id].run_session, args=())
+                thread_name = f"{self.port}-session-{self.session_id}"
+                client_thread = threading.Thread(target=create_thread_marker(thread_name), args=(self.sessions[self.session_id].run_session,), name=thread_name)
                 client_thread.daemon = True
                 client_thread.start()
 
@@ -210,19 +265,25 @@ class ModelContainer:
         self.q_state.put(f"{self.port},Loading model...")
         self.q_log_messages.put(f"{self.port} Loading model...")
 
-        self.model = load_model(self.model_path)
-        self.dataset_len:int = self.model.input_shape[1]
-        self.scaler = StandardScaler()
-        self.data_queue = deque(maxlen = self.dataset_len)
+        if not self.load_models():
+            self.stop_container()
+            return
+
+        self.q_state.put(f"{self.port},Model loaded. Warming up...")
+        self.warm_up()
         
-        self.q_state.put(f"{self.port},Model loaded. Starting socket server...")
-        self.q_log_messages.put(f"{self.port} Model loaded. Starting socket server...")
+        self.q_state.put(f"{self.port},Model loaded. Starting {self.transport.lower()} server...")
+        self.q_log_messages.put(f"{self.port} Model loaded. Starting {self.transport.lower()} server...")
         self.th_read = threading.Thread(target=self.run_server, args=())
         self.th_read.start()
     
+    def toggle_profiling(self):
+        self.profiler.toggle()
+
     def stop_container(self):
         if self.is_active:
             self.is_active = False
+            self.profiler.stop()
             for s_id in self.sessions:
                 self.q_log_messages.put(f"{self.port} Disconnecting session {s_id}")
                 self.sessions[s_id].on_stop()
@@ -244,3 +305,43 @@ class ModelContainer:
 
     def on_closing(self):
         self.stop_container() 
+
+# Serves several models with equal dataset_len on a single port. Every window is received,
+# parsed and normalized once per session and passed to all models. Replies contain one
+# prediction (series) per model separated by ';' in the order the models were added.
+class EnsembleContainer(ModelContainer):
+    def __init__(self, port, model_paths, model_full_name, q_state, q_log_messages, allow_log_latencies, transport = transport_socket):
+        super().__init__(port, model_paths[0], model_full_name, q_state, q_log_messages, allow_log_latencies, transport)
+        self.model_paths = model_paths
+        self.num_models = len(model_paths)
+        self.models = []
+        self.executor = None
+        self.run_in_inference_thread = create_thread_marker(f"{port}-inference")
+
+    def predict_all(self, input_data):
+        # Keras releases the GIL inside predict, so models run concurrently
+        with self.lock:
+            # Sessions may still be working through queued messages after stop_container
+            if self.executor == None:
+                return None
+            futures = [self.executor.submit(self.run_in_inference_thread, model.predict, input_data, verbose=0) for model in self.models]
+            return [future.result() for future in futures]
+
+    def load_models(self):
+        self.models = [load_model(model_path) for model_path in self.model_paths]
+        dataset_lens = [model.input_shape[1] for model in self.models]
+        if len(set(dataset_lens)) != 1:
+            self.q_log_messages.put(f"{self.port} Ensemble models have different input lengths: {dataset_lens}")
+            return False
+
+        self.model = self.models[0]
+        self.dataset_len:int = dataset_lens[0]
+        self.executor = ThreadPoolExecutor(max_workers=self.num_models, thread_name_prefix=f"{self.port}-inference")
+        return True
+
+    def stop_container(self):
+        super().stop_container()
+        with self.lock:
+            if self.executor != None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
@@ -0,0 +1,311 @@
+"""
+DT-Box-Inference
+Pavel Chigirev, pavelchigirev.com, 2023-2024
+See LICENSE.txt for details
+"""
+
+import cProfile
+import inspect
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+default_profile_dir = os.path.join(tempfile.gettempdir(), "DT-Box-Inference", "profiles")
+default_duration = 30.0
+sampling_interval = 0.005
+# Deep enough for the Keras predict call chain under run_model and the thread markers
+tracemalloc_frames = 256
+report_top = 30
+
+# Since Python 3.12 cProfile is built on sys.monitoring and one profile covers all threads of the
+# process, before that a profile only sees the thread it was enabled in. On 3.12+ there can be only
+# one, so containers share a single process-wide profile and the cProfile report is not per container
+is_cprofile_global = sys.version_info >= (3, 12)
+cprofile_users = 0
+cprofile_process = None
+cprofile_lock = threading.Lock()
+
+def start_process_cprofile():
+    global cprofile_users, cprofile_process
+    with cprofile_lock:
+        if cprofile_users == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Some other tool is profiling the process
+                return False
+            cprofile_process = profile
+        cprofile_users += 1
+        return True
+
+def stop_process_cprofile():
+    # Stats collected since the first user started, the profile keeps running for the others
+    global cprofile_users, cprofile_process
+    with cprofile_lock:
+        cprofile_users -= 1
+        cprofile_process.disable()
+        stats = pstats.Stats(cprofile_process)
+        if cprofile_users == 0:
+            cprofile_process = None
+        else:
+            cprofile_process.enable()
+        return stats
+
+# tracemalloc is process wide, it runs while at least one container is being profiled.
+# Tracing started outside the profiler is left running
+tracemalloc_users = 0
+is_tracemalloc_started = False
+tracemalloc_lock = threading.Lock()
+
+def start_tracemalloc():
+    global tracemalloc_users, is_tracemalloc_started
+    with tracemalloc_lock:
+        if tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(tracemalloc_frames)
+            is_tracemalloc_started = True
+        tracemalloc_users += 1
+
+def stop_tracemalloc():
+    global tracemalloc_users, is_tracemalloc_started
+    with tracemalloc_lock:
+        tracemalloc_users -= 1
+        if tracemalloc_users == 0 and is_tracemalloc_started:
+            tracemalloc.stop()
+            is_tracemalloc_started = False
+
+thread_marker_prefix = "<thread "
+
+# tracemalloc tracebacks don't record the thread, so code run by a container thread goes through a
+# function whose file name is the thread name; its frame then tells which thread allocated
+def create_thread_marker(thread_name):
+    namespace = {}
+    source = "def run_in_thread(func, *args, **kwargs):\n    return func(*args, **kwargs)\n"
+    exec(compile(source, f"{thread_marker_prefix}{thread_name}>", "exec"), namespace)
+    return namespace['run_in_thread']
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+# Time-bounded profile of a single model container:
+#   - cProfile of every call wrapped with run() (session threads), process-wide on Python 3.12+
+#   - stack sampling of all threads named "<port>-..." (session and inference threads)
+#   - tracemalloc statistics for the allocations made inside the traced functions and per thread
+class ModelProfiler:
+    def __init__(self, port, q_log_messages, traced_functions = (), profile_dir = default_profile_dir):
+        self.port = port
+        self.q_log_messages = q_log_messages
+        self.traced_functions = traced_functions
+        self.profile_dir = profile_dir
+
+        self.is_active = False
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.samples = Counter()
+        self.stacks = Counter()
+        self.num_samples = 0
+        self.is_process_cprofile_started = False
+        self.process_stats = None
+        self.timer = None
+
+    def run(self, func, *args):
+        if not self.is_active or is_cprofile_global:
+            return func(*args)
+
+        thread_id = threading.get_ident()
+        profile = self.profiles.get(thread_id)
+        if profile == None:
+            profile = cProfile.Profile()
+            with self.lock:
+                self.profiles[thread_id] = profile
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread, sampling still covers it
+            return func(*args)
+
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def toggle(self, duration = default_duration):
+        if self.is_active:
+            self.stop()
+        else:
+            self.start(duration)
+
+    def start(self, duration = default_duration):
+        with self.lock:
+            if self.is_active:
+                return
+            self.profiles = {}
+            self.samples = Counter()
+            self.stacks = Counter()
+            self.num_samples = 0
+            self.start_time = time.time()
+
+            start_tracemalloc()
+            self.snapshot_start = take_snapshot()
+
+            self.process_stats = None
+            if is_cprofile_global:
+                self.is_process_cprofile_started = start_process_cprofile()
+                if not self.is_process_cprofile_started:
+                    self.q_log_messages.put(f"{self.port} Another profiler is active, cProfile report will be empty")
+
+            self.is_active = True
+
+        self.th_sampler = threading.Thread(target=self.run_sampler, args=())
+        self.th_sampler.daemon = True
+        self.th_sampler.start()
+
+        self.timer = threading.Timer(duration, self.stop)
+        self.timer.daemon = True
+        self.timer.start()
+        cprofile_scope = "process-wide cProfile" if is_cprofile_global else "cProfile of session threads"
+        self.q_log_messages.put(f"{self.port} Profiling started for {duration:.0f} seconds ({cprofile_scope})")
+
+    def stop(self):
+        with self.lock:
+            if not self.is_active:
+                return
+            self.is_active = False
+
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+        self.th_sampler.join()
+
+        if self.is_process_cprofile_started:
+            self.process_stats = stop_process_cprofile()
+            self.is_process_cprofile_started = False
+
+        snapshot_end = take_snapshot()
+        stop_tracemalloc()
+
+        try:
+            report_path = self.write_reports(snapshot_end)
+            self.q_log_messages.put(f"{self.port} Profiling stopped. Reports saved to {report_path}_*")
+        except Exception as e:
+            self.q_log_messages.put(f"{self.port} Profiling stopped. Cannot save reports: {e}")
+
+    def run_sampler(self):
+        thread_prefix = f"{self.port}-"
+        while self.is_active:
+            names = {th.ident: th.name for th in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if not names.get(thread_id, '').startswith(thread_prefix):
+                    continue
+
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+
+                self.samples[stack[0]] += 1
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.num_samples += 1
+
+            time.sleep(sampling_interval)
+
+    def write_reports(self, snapshot_end):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        report_path = os.path.join(self.profile_dir, f"{self.port}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(self.start_time))}")
+
+        # cProfile, merged over this container's session threads or process-wide on Python 3.12+
+        if is_cprofile_global:
+            cprofile_path = report_path + "_cprofile_process"
+            stats = self.process_stats
+        else:
+            cprofile_path = report_path + "_cprofile"
+            profiles = list(self.profiles.values())
+            stats = pstats.Stats(*profiles) if len(profiles) > 0 else None
+
+        with open(cprofile_path + ".txt", 'w') as f:
+            if stats == None:
+                f.write("No calls were profiled\n")
+            else:
+                if is_cprofile_global:
+                    f.write("Process-wide profile: all threads of the process (other containers, UI, profiler) since the first\n")
+                    f.write("container started profiling. Python 3.12+ allows a single cProfile per process.\n\n")
+                stats.dump_stats(cprofile_path + ".prof")
+                stats.stream = f
+                stats.sort_stats('cumulative').print_stats(report_top)
+
+        # Stack sampling, leaf functions and collapsed stacks (flame graph input)
+        with open(report_path + "_sampling.txt", 'w') as f:
+            f.write(f"Samples: {self.num_samples}, interval {sampling_interval * 1000:.1f} ms\n\n")
+            for leaf, count in self.samples.most_common(report_top):
+                f.write(f"{count:8d} {count / max(self.num_samples, 1) * 100:6.2f}%  {leaf}\n")
+        with open(report_path + "_stacks.txt", 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(report_path + "_tracemalloc.txt", 'w') as f:
+            f.write(self.format_tracemalloc(snapshot_end))
+
+        return report_path
+
+    def format_tracemalloc(self, snapshot_end):
+        out = io.StringIO()
+        snapshot_diff = snapshot_end.compare_to(self.snapshot_start, 'traceback')
+
+        for func in self.traced_functions:
+            source_lines, first_line = inspect.getsourcelines(func)
+            filename = inspect.getsourcefile(func)
+            last_line = first_line + len(source_lines) - 1
+
+            # Group by the traced function line and the place the memory was actually allocated
+            sizes = Counter()
+            counts = Counter()
+            for stat in snapshot_diff:
+                inside = [frame for frame in stat.traceback if frame.filename == filename and first_line <= frame.lineno <= last_line]
+                if len(inside) == 0 or stat.size_diff == 0:
+                    continue
+                allocated = stat.traceback[-1]
+                key = f"{os.path.basename(filename)}:{inside[-1].lineno} -> {os.path.basename(allocated.filename)}:{allocated.lineno}"
+                sizes[key] += stat.size_diff
+                counts[key] += stat.count_diff
+
+            out.write(f"{func.__qualname__}: {sum(sizes.values()) / 1024:.1f} KiB net, {sum(counts.values())} blocks net\n")
+            for key, size in sorted(sizes.items(), key=lambda item: abs(item[1]), reverse=True)[:report_top]:
+                out.write(f"    {size / 1024:+10.1f} KiB {counts[key]:+8d} blocks  {key}\n")
+            out.write("\n")
+
+        # Per container thread, including ensemble inference threads where run_model is not on the stack
+        thread_prefix = f"{thread_marker_prefix}{self.port}-"
+        thread_sizes = Counter()
+        thread_counts = Counter()
+        site_sizes = {}
+        for stat in snapshot_diff:
+            markers = [frame.filename for frame in stat.traceback if frame.filename.startswith(thread_prefix)]
+            if len(markers) == 0 or stat.size_diff == 0:
+                continue
+            thread_name = markers[0][len(thread_marker_prefix):-1]
+            allocated = stat.traceback[-1]
+            site = f"{os.path.basename(allocated.filename)}:{allocated.lineno}"
+            thread_sizes[thread_name] += stat.size_diff
+            thread_counts[thread_name] += stat.count_diff
+            site_sizes.setdefault(thread_name, Counter())[site] += stat.size_diff
+
+        out.write("By thread:\n")
+        for thread_name, size in sorted(thread_sizes.items(), key=lambda item: abs(item[1]), reverse=True):
+            out.write(f"{thread_name}: {size / 1024:.1f} KiB net, {thread_counts[thread_name]} blocks net\n")
+            for site, site_size in sorted(site_sizes[thread_name].items(), key=lambda item: abs(item[1]), reverse=True)[:report_top]:
+                out.write(f"    {site_size / 1024:+10.1f} KiB  {site}\n")
+        out.write("\n")
+
+        out.write("Top allocations overall:\n")
+        for stat in snapshot_end.compare_to(self.snapshot_start, 'lineno')[:report_top]:
+            out.write(f"    {stat}\n")
+
+        return out.getvalue()
@@ -0,0 +1,464 @@
+"""
+DT-Box-Inference
+Pavel Chigirev, pavelchigirev.com, 2023-2024
+See LICENSE.txt for details
+"""
+
+import ctypes
+import glob
+import itertools
+import mmap
+import os
+import platform
+import struct
+import tempfile
+import time
+import uuid
+
+# Memory-mapped ring buffer transport for clients running on the same machine.
+# A client creates <shm_dir>/<port>_<pid>_<token>_<counter>.ring and the server picks it up as a new session.
+# The file holds two single-producer/single-consumer rings (client->server requests and
+# server->client replies) carrying the same length-prefixed messages as the socket transport.
+# Each side stores its PID in the header, so a peer that died without closing is detected.
+#
+# A reader with nothing to read spins briefly, then sets the ring's reader waiting flag and
+# blocks on a wake-up signal: a futex on the flag itself on Linux, a named auto-reset event on
+# Windows. The writer signals only when it finds the flag set, so a busy stream costs no syscalls.
+#
+# Positions and flags are published with plain stores, with no explicit fence. This relies on
+# the total store order of x86/x64 (the platforms MetaTrader5 runs on), where other cores never
+# see the position move before the data it covers. The one reordering x86 allows, a later load
+# passing an earlier store, can make the reader and the writer miss each other's flag/position;
+# the reader's wait is bounded by wait_timeout, so such a lost wake-up only delays a message.
+#
+# File layout, little-endian:
+#   0   magic u32, version u32
+#   8   ring capacity u64
+#   16  client closed u32, server closed u32
+#   24  client pid u32, server pid u32
+#   64  request ring: write position u64, read position u64, reader waiting u32, data at 128
+#   128 + capacity  reply ring: same ring header, data 64 bytes later
+
+default_shm_dir = os.path.join(tempfile.gettempdir(), "DT-Box-Inference")
+default_capacity = 1 << 20
+
+ring_magic = 0x52425444
+ring_version = 3
+header_len = 64
+ring_header_len = 64
+
+offset_capacity = 8
+offset_client_closed = 16
+offset_server_closed = 20
+offset_client_pid = 24
+offset_server_pid = 28
+
+# Reader spins this many times before blocking, ticks sent back to back are picked up without a syscall.
+# On a single core spinning only takes the CPU away from the writer
+spin_count = 50 if (os.cpu_count() or 1) > 1 else 0
+# Upper bound of a single blocking wait, also how often an idle reader re-checks its peer
+wait_timeout = 0.05
+# Writer waiting for free space in a full ring (rare, the ring holds many messages)
+full_ring_sleep = 0.0002
+liveness_check_interval = 1.0
+default_connect_timeout = 5.0
+
+if os.name == 'nt':
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateEventW.argtypes = [wintypes.LPVOID, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR]
+    kernel32.CreateEventW.restype = wintypes.HANDLE
+    kernel32.SetEvent.argtypes = [wintypes.HANDLE]
+    kernel32.SetEvent.restype = wintypes.BOOL
+    kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+    kernel32.WaitForSingleObject.restype = wintypes.DWORD
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.GetExitCodeProcess.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+    kernel32.GetExitCodeProcess.restype = wintypes.BOOL
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    kernel32.CloseHandle.restype = wintypes.BOOL
+
+    process_query_limited_information = 0x1000
+    still_active = 259
+    error_access_denied = 5
+
+def is_process_alive(pid):
+    if pid == 0:
+        # Peer has not attached yet
+        return True
+
+    if os.name == 'nt':
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return ctypes.get_last_error() == error_access_denied
+        exit_code = wintypes.DWORD()
+        is_ok = kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return not is_ok or exit_code.value == still_active
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+futex_syscalls = {'x86_64': 202, 'amd64': 202, 'aarch64': 98, 'i386': 240, 'i686': 240, 'armv7l': 240}
+futex_wait = 0
+futex_wake = 1
+
+if os.name != 'nt' and platform.system() == 'Linux' and platform.machine().lower() in futex_syscalls:
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+    sys_futex = futex_syscalls[platform.machine().lower()]
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+else:
+    libc = None
+
+# Futex on the reader waiting flag, shared (not private) so it works across processes
+class FutexNotifier:
+    def __init__(self, mm, offset, name):
+        self.word = ctypes.c_uint32.from_buffer(mm, offset)
+        self.addr = ctypes.addressof(self.word)
+
+    def wait(self, timeout):
+        # Returns at once if the writer has already cleared the flag
+        ts = timespec(int(timeout), int((timeout % 1) * 1e9))
+        libc.syscall(ctypes.c_long(sys_futex), ctypes.c_void_p(self.addr), ctypes.c_int(futex_wait), ctypes.c_uint32(1), ctypes.byref(ts), None, ctypes.c_uint32(0))
+
+    def signal(self):
+        libc.syscall(ctypes.c_long(sys_futex), ctypes.c_void_p(self.addr), ctypes.c_int(futex_wake), ctypes.c_int(1), None, None, ctypes.c_uint32(0))
+
+    def close(self):
+        # Releases the export of the mmap buffer, mmap.close() fails while it exists
+        self.word = None
+
+# Named auto-reset event, a signal sent while nobody waits just makes the next wait return at once
+class EventNotifier:
+    def __init__(self, mm, offset, name):
+        self.handle = kernel32.CreateEventW(None, False, False, name)
+        if not self.handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def wait(self, timeout):
+        kernel32.WaitForSingleObject(self.handle, int(timeout * 1000))
+
+    def signal(self):
+        kernel32.SetEvent(self.handle)
+
+    def close(self):
+        if self.handle:
+            kernel32.CloseHandle(self.handle)
+            self.handle = None
+
+# Other platforms have no cross-process wake-up here, the reader falls back to short sleeps
+class SleepNotifier:
+    def __init__(self, mm, offset, name):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, 0.001))
+
+    def signal(self):
+        pass
+
+    def close(self):
+        pass
+
+def create_notifier(mm, offset, name):
+    if os.name == 'nt':
+        return EventNotifier(mm, offset, name)
+    if libc != None:
+        return FutexNotifier(mm, offset, name)
+    return SleepNotifier(mm, offset, name)
+
+class RingBuffer:
+    def __init__(self, mm:mmap.mmap, offset, capacity, notifier_name):
+        self.mm = mm
+        self.offset_write_pos = offset
+        self.offset_read_pos = offset + 8
+        self.offset_reader_waiting = offset + 16
+        self.offset_data = offset + ring_header_len
+        self.capacity = capacity
+        self.notifier = create_notifier(mm, self.offset_reader_waiting, notifier_name)
+
+    def get_pos(self, offset):
+        return struct.unpack_from('<Q', self.mm, offset)[0]
+
+    def set_pos(self, offset, pos):
+        struct.pack_into('<Q', self.mm, offset, pos)
+
+    def write(self, data, is_open:callable):
+        written = 0
+        while written < len(data):
+            write_pos = self.get_pos(self.offset_write_pos)
+            free = self.capacity - (write_pos - self.get_pos(self.offset_read_pos))
+            if free == 0:
+                if not is_open():
+                    raise ConnectionError("Shared memory channel closed")
+                time.sleep(full_ring_sleep)
+                continue
+
+            n = min(free, len(data) - written)
+            start = write_pos % self.capacity
+            first = min(n, self.capacity - start)
+            self.mm[self.offset_data + start : self.offset_data + start + first] = data[written : written + first]
+            if n > first:
+                self.mm[self.offset_data : self.offset_data + n - first] = data[written + first : written + n]
+
+            # Data is in place before the position moves, so the reader never sees a partial chunk
+            self.set_pos(self.offset_write_pos, write_pos + n)
+            written += n
+            self.notify_reader()
+
+    def read(self, max_len):
+        read_pos = self.get_pos(self.offset_read_pos)
+        n = min(max_len, self.get_pos(self.offset_write_pos) - read_pos)
+        if n == 0:
+            return b''
+
+        start = read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        data = self.mm[self.offset_data + start : self.offset_data + start + first]
+        if n > first:
+            data += self.mm[self.offset_data : self.offset_data + n - first]
+
+        self.set_pos(self.offset_read_pos, read_pos + n)
+        return data
+
+    def is_reader_waiting(self):
+        return struct.unpack_from('<I', self.mm, self.offset_reader_waiting)[0] != 0
+
+    def set_reader_waiting(self, is_waiting):
+        struct.pack_into('<I', self.mm, self.offset_reader_waiting, 1 if is_waiting else 0)
+
+    def wait_readable(self, timeout):
+        self.set_reader_waiting(True)
+        # A writer that published before it could see the flag will not signal, so look again
+        if self.get_pos(self.offset_write_pos) == self.get_pos(self.offset_read_pos):
+            self.notifier.wait(timeout)
+        self.set_reader_waiting(False)
+
+    def notify_reader(self):
+        if self.is_reader_waiting():
+            self.set_reader_waiting(False)
+            self.notifier.signal()
+
+    def close(self):
+        self.notifier.close()
+
+# Socket-like endpoint (send/recv/close), so sessions run on it the same way as on a client socket
+class SharedMemoryChannel:
+    def __init__(self, path, is_server):
+        self.path = path
+        self.is_server = is_server
+        self.is_open = True
+        self.last_liveness_check = time.monotonic()
+
+        with open(path, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+
+        magic, version = struct.unpack_from('<II', self.mm, 0)
+        if magic != ring_magic or version != ring_version:
+            self.mm.close()
+            raise ValueError(f"{path} is not a DT-Box-Inference ring buffer")
+
+        [capacity,] = struct.unpack_from('<Q', self.mm, offset_capacity)
+        notifier_name = f"Local\\DT-Box-Inference-{os.path.basename(path)}"
+        request_ring = RingBuffer(self.mm, header_len, capacity, notifier_name + "-request")
+        reply_ring = RingBuffer(self.mm, header_len + ring_header_len + capacity, capacity, notifier_name + "-reply")
+
+        if is_server:
+            self.ring_recv, self.ring_send = request_ring, reply_ring
+            self.offset_own_closed, self.offset_peer_closed = offset_server_closed, offset_client_closed
+            self.offset_own_pid, self.offset_peer_pid = offset_server_pid, offset_client_pid
+        else:
+            self.ring_recv, self.ring_send = reply_ring, request_ring
+            self.offset_own_closed, self.offset_peer_closed = offset_client_closed, offset_server_closed
+            self.offset_own_pid, self.offset_peer_pid = offset_client_pid, offset_server_pid
+
+        struct.pack_into('<I', self.mm, self.offset_own_pid, os.getpid())
+
+    @staticmethod
+    def create_file(path, capacity):
+        header = struct.pack('<IIQIIII', ring_magic, ring_version, capacity, 0, 0, os.getpid(), 0)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.truncate(header_len + 2 * (ring_header_len + capacity))
+
+    def is_peer_open(self):
+        return self.is_open and struct.unpack_from('<I', self.mm, self.offset_peer_closed)[0] == 0
+
+    def is_peer_alive(self):
+        # Called while waiting only, the process lookup is throttled to keep idle waiting cheap
+        now = time.monotonic()
+        if now - self.last_liveness_check < liveness_check_interval:
+            return True
+        self.last_liveness_check = now
+        return is_process_alive(struct.unpack_from('<I', self.mm, self.offset_peer_pid)[0])
+
+    def is_peer_connected(self):
+        return self.is_peer_open() and self.is_peer_alive()
+
+    def send(self, data):
+        if not self.is_peer_open():
+            raise ConnectionError("Shared memory channel closed")
+        self.ring_send.write(data, self.is_peer_connected)
+        return len(data)
+
+    def recv(self, bufsize):
+        iteration = 0
+        while True:
+            if not self.is_open:
+                raise ConnectionError("Shared memory channel closed")
+
+            data = self.ring_recv.read(bufsize)
+            if len(data) > 0:
+                return data
+
+            if not self.is_peer_connected():
+                raise ConnectionError("Shared memory channel closed")
+
+            if iteration < spin_count:
+                time.sleep(0)
+                iteration += 1
+                continue
+
+            try:
+                self.ring_recv.wait_readable(wait_timeout)
+            except ValueError:
+                # Closed by another thread while waiting
+                raise ConnectionError("Shared memory channel closed")
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            struct.pack_into('<I', self.mm, self.offset_own_closed, 1)
+
+            # Wake the peer's reader to see the closed flag and a local reader blocked in recv
+            self.ring_send.notify_reader()
+            self.ring_recv.notifier.signal()
+            self.ring_send.close()
+            self.ring_recv.close()
+            self.mm.close()
+
+            # Whoever closes last removes the file, on Windows a mapped file cannot be deleted
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+# Listener with the accept/close part of the socket server interface
+class SharedMemoryServer:
+    def __init__(self, port, shm_dir = default_shm_dir):
+        self.port = port
+        self.shm_dir = shm_dir
+        self.is_active = True
+        self.known_paths = set()
+
+        # Files of clients that are still running are picked up by accept, whatever the start order
+        os.makedirs(self.shm_dir, exist_ok=True)
+        for path in glob.glob(self.get_pattern()):
+            if not SharedMemoryServer.is_stale(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def is_stale(path):
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(header_len)
+        except OSError:
+            return False
+
+        if len(header) < header_len:
+            return True
+        magic, version = struct.unpack_from('<II', header, 0)
+        if magic != ring_magic or version != ring_version:
+            return True
+        [client_pid,] = struct.unpack_from('<I', header, offset_client_pid)
+        return not is_process_alive(client_pid)
+
+    def get_pattern(self):
+        return os.path.join(self.shm_dir, f"{self.port}_*.ring")
+
+    def accept(self):
+        while self.is_active:
+            paths = sorted(glob.glob(self.get_pattern()))
+            # Forget files that are gone, so a client reusing a name is accepted again
+            self.known_paths.intersection_update(paths)
+            for path in paths:
+                if path in self.known_paths:
+                    continue
+                self.known_paths.add(path)
+                try:
+                    return SharedMemoryChannel(path, True), path
+                except (OSError, ValueError):
+                    continue
+
+            # Connections are rare compared to ticks, no need to spin here
+            time.sleep(0.05)
+
+        raise OSError("Shared memory server closed")
+
+    def close(self):
+        self.is_active = False
+
+class SharedMemoryClient(SharedMemoryChannel):
+    client_ids = itertools.count()
+    # PIDs get reused, the token keeps names of different client processes apart
+    client_token = uuid.uuid4().hex[:12]
+
+    def __init__(self, port, shm_dir = default_shm_dir, capacity = default_capacity, connect_timeout = default_connect_timeout):
+        name = f"{port}_{os.getpid()}_{SharedMemoryClient.client_token}_{next(SharedMemoryClient.client_ids)}"
+        tmp_path = os.path.join(shm_dir, name + ".tmp")
+        path = os.path.join(shm_dir, name + ".ring")
+
+        # The file appears under its final name only when fully initialized
+        os.makedirs(shm_dir, exist_ok=True)
+        SharedMemoryChannel.create_file(tmp_path, capacity)
+        os.replace(tmp_path, path)
+        super().__init__(path, False)
+
+        # The server writes its PID when it accepts the channel, same role as a refused connection
+        deadline = time.monotonic() + connect_timeout
+        while struct.unpack_from('<I', self.mm, offset_server_pid)[0] == 0:
+            if time.monotonic() >= deadline:
+                self.close()
+                raise ConnectionError(f"No shared memory server accepted the connection on {port} port")
+            time.sleep(0.01)
+
+    def send_data(self, msg):
+        # Null-terminated like the strings MQL5 clients send over the socket
+        data = msg.encode() + b'\x00'
+        self.send(struct.pack('<q', len(data)) + data)
+
+    def receive_data(self):
+        size_buf = self.recv_exact(8)
+        [msg_size,] = struct.unpack('<q', size_buf)
+        return self.recv_exact(msg_size).decode()
+
+    def recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            data.extend(self.recv(size - len(data)))
+        return bytes(data)
+
+if __name__ == "__main__":
+    import sys
+    c = SharedMemoryClient(int(sys.argv[1]) if len(sys.argv) > 1 else 16505)
+    print('Connected to', c.path)
+
+    c.send_data('cmd_hb;')
+    print(c.receive_data())
+
+    c.send_data('cmd_cc;')
+    c.close()
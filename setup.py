@@ -11,9 +11,8 @@ setup(
     version='1.0',
     packages=find_packages(),
     install_requires=[
-        'numpy>=1.18.5',
+        'numpy>=1.20.0',
         'tensorflow>=2.3.0',
-        'keras>=2.3.0',
-        'scikit-learn>=0.23.1'
+        'keras>=2.3.0'
     ],
 )
\ No newline at end of file